@@ -1,32 +1,141 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, has_request_context
+from flask.json.provider import JSONProvider
 from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
 from flask_cors import CORS
+from flask_compress import Compress
 from datetime import timedelta
-from models import db, User
-from routes import api
+from decimal import Decimal
+from logging.handlers import QueueHandler, QueueListener
+from queue import SimpleQueue
+from uuid import uuid4
+import atexit
+import copy
+import logging
+from models import db, User, add_geohash_column, create_spatial_index
+from sqlalchemy import func, select
+from routes import api, invalidate_user_cache
+import orjson
 import os
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+log = logging.getLogger(__name__)
+
+class _RequestIdFilter(logging.Filter):
+    """Stamp each record with the current request's ID, or '-' outside a request"""
+    def filter(self, record):
+        record.request_id = g.get('request_id', '-') if has_request_context() else '-'
+        return True
+
+class _JSONFormatter(logging.Formatter):
+    """One orjson-encoded object per log line"""
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'request_id': getattr(record, 'request_id', '-'),
+            'message': record.getMessage()
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        return orjson.dumps(entry).decode()
+
+class _QueueHandler(QueueHandler):
+    """QueueHandler that keeps the traceback out of the message so it stays a separate field"""
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.message = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            # Tracebacks reference frames, so render them before the record leaves this thread
+            record.exc_text = _traceback_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+_traceback_formatter = logging.Formatter()
+
+def configure_logging():
+    """Route all logging through a queue so request threads never block on log I/O"""
+    root = logging.getLogger()
+    if any(isinstance(handler, QueueHandler) for handler in root.handlers):
+        return
+    
+    output = logging.StreamHandler()
+    output.setFormatter(_JSONFormatter())
+    queue = SimpleQueue()
+    handler = _QueueHandler(queue)
+    handler.addFilter(_RequestIdFilter())
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+    
+    listener = QueueListener(queue, output, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+def _orjson_default(obj):
+    """Serialize the types Flask's default provider handles that orjson does not"""
+    if isinstance(obj, Decimal):
+        return str(obj)
+    if hasattr(obj, '__html__'):
+        return str(obj.__html__())
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+class ORJSONProvider(JSONProvider):
+    """JSON provider backed by orjson, so jsonify() and request.get_json() skip the stdlib encoder"""
+    mimetype = 'application/json'
+    
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=_orjson_default).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+    
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        # Hand orjson's bytes straight to the response instead of round-tripping through str
+        return self._app.response_class(orjson.dumps(obj, default=_orjson_default), mimetype=self.mimetype)
+
 def create_app():
     """Application factory - SQLAlchemy only"""
+    configure_logging()
     app = Flask(__name__)
+    app.json = ORJSONProvider(app)
     
     # Configuration
     app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-secret-key')
     app.config['JWT_SECRET_KEY'] = os.getenv('JWT_SECRET_KEY', 'jwt-secret-key')
     app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(hours=24)
+    # Caps request bodies, including chunked ones that declare no Content-Length
+    app.config['MAX_CONTENT_LENGTH'] = 64 * 1024
     
     # SQLite Database Configuration
     app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///lostfound.db')
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-    app.config['SQLALCHEMY_ECHO'] = os.getenv('FLASK_ENV') == 'development'
+    # SQL echo goes through the app's log pipeline rather than SQLAlchemy's own stream handler
+    if os.getenv('FLASK_ENV') == 'development':
+        logging.getLogger('sqlalchemy.engine').setLevel(logging.INFO)
+    # Room for every statement shape the API issues in the compiled-SQL cache
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'query_cache_size': 1200}
+    
+    # Response compression for JSON payloads (device lists compress well)
+    app.config['COMPRESS_ALGORITHM'] = ['br', 'gzip']
+    app.config['COMPRESS_MIMETYPES'] = ['application/json']
+    app.config['COMPRESS_MIN_SIZE'] = 1024
+    app.config['COMPRESS_BR_LEVEL'] = 4
+    app.config['COMPRESS_LEVEL'] = 4
+    # Flask-Compress 1.14 compresses a stream by buffering all of it, so streamed
+    # responses (the admin device pages) are sent uncompressed instead
+    app.config['COMPRESS_STREAMS'] = False
     
     # Initialize extensions
     db.init_app(app)
     jwt = JWTManager(app)
+    Compress(app)
     
     # CORS Configuration
     cors_origins = os.getenv('CORS_ORIGINS', 'http://localhost:3000').split(',')
@@ -35,24 +144,43 @@ def create_app():
     # Register blueprints
     app.register_blueprint(api, url_prefix='/api')
     
+    @app.before_request
+    def _assign_request_id():
+        g.request_id = request.headers.get('X-Request-ID') or uuid4().hex
+    
+    @app.after_request
+    def _echo_request_id(response):
+        if 'request_id' in g:
+            response.headers['X-Request-ID'] = g.request_id
+        return response
+    
     # Create tables
     with app.app_context():
         try:
             db.create_all()
-            print("✅ SQLAlchemy database tables created successfully")
-        except Exception as e:
-            print(f"❌ Error creating database tables: {e}")
+            add_geohash_column()
+            create_spatial_index()
+            log.info("SQLAlchemy database tables created successfully")
+        except Exception:
+            log.exception("Error creating database tables")
     
     return app
 
 # Create app instance
 app = create_app()
 
+def _clean_fields(data):
+    """Strip surrounding whitespace from every string field in one pass; passwords are kept verbatim"""
+    if not isinstance(data, dict):
+        return None
+    return {key: value.strip() if isinstance(value, str) and key != 'password' else value
+            for key, value in data.items()}
+
 @app.route('/api/auth/register', methods=['POST'])
 def register():
     """User registration endpoint using SQLAlchemy"""
     try:
-        data = request.get_json()
+        data = _clean_fields(request.get_json())
         
         # Validate input
         if not data or not data.get('username') or not data.get('password'):
@@ -63,18 +191,19 @@ def register():
             return jsonify({"message": "Username already exists"}), 400
         
         # Check if email already exists (if provided) using SQLAlchemy
-        email = data.get('email', '').strip()
+        email = data.get('email') or ''
         if email and User.find_by_email(email):
             return jsonify({"message": "Email already exists"}), 400
         
         # Create new user using SQLAlchemy
         user = User(
-            username=data['username'].strip(),
+            username=data['username'],
             email=email if email else None,
             password=data['password']
         )
         
         if user.save():
+            invalidate_user_cache(user.username)
             return jsonify({
                 "message": "User created successfully",
                 "user": {
@@ -86,15 +215,15 @@ def register():
         else:
             return jsonify({"message": "Failed to create user"}), 500
         
-    except Exception as e:
-        print(f"Registration error: {e}")
+    except Exception:
+        log.exception("Registration error")
         return jsonify({"error": "Internal server error"}), 500
 
 @app.route('/api/auth/login', methods=['POST'])
 def login():
     """User login endpoint using SQLAlchemy"""
     try:
-        data = request.get_json()
+        data = _clean_fields(request.get_json())
         
         # Validate input
         if not data or not data.get('username') or not data.get('password'):
@@ -105,7 +234,10 @@ def login():
         
         if user and user.check_password(data['password']):
             # Create access token
-            access_token = create_access_token(identity=user.username)
+            access_token = create_access_token(
+                identity=user.username,
+                additional_claims={'uid': user.id, 'is_admin': user.is_admin}
+            )
             return jsonify({
                 "token": access_token,
                 "username": user.username,
@@ -115,8 +247,8 @@ def login():
         
         return jsonify({"message": "Invalid credentials"}), 401
         
-    except Exception as e:
-        print(f"Login error: {e}")
+    except Exception:
+        log.exception("Login error")
         return jsonify({"error": "Internal server error"}), 500
 
 @app.route('/api/auth/profile', methods=['GET'])
@@ -130,8 +262,8 @@ def get_profile():
         
         return jsonify(current_user.to_dict()), 200
         
-    except Exception as e:
-        print(f"Profile error: {e}")
+    except Exception:
+        log.exception("Profile error")
         return jsonify({"error": "Internal server error"}), 500
 
 @app.route('/api/health', methods=['GET'])
@@ -139,7 +271,7 @@ def health():
     """Health check endpoint"""
     try:
         # Test SQLAlchemy database connection
-        user_count = User.query.count()
+        user_count = db.session.scalar(select(func.count(User.id)))
         return jsonify({
             "status": "healthy",
             "database": "SQLAlchemy + SQLite",
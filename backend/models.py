@@ -1,9 +1,13 @@
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
-from sqlalchemy import func
+from sqlalchemy import func, select, update, delete, text, table, column, literal, union_all, and_, or_, event, inspect
+from sqlalchemy.dialects import postgresql
+from geo import GEOHASH_PRECISION, geohash_cover, geohash_encode, geohash_ranges
+import logging
 
 db = SQLAlchemy()
+log = logging.getLogger(__name__)
 
 class User(db.Model):
     """User model for authentication - SQLAlchemy only"""
@@ -38,19 +42,19 @@ class User(db.Model):
     @staticmethod
     def find_by_username(username):
         """Find user by username using SQLAlchemy"""
-        return User.query.filter_by(username=username).first()
+        return db.session.scalars(select(User).filter_by(username=username)).first()
     
     @staticmethod
     def find_by_email(email):
         """Find user by email using SQLAlchemy"""
         if not email:
             return None
-        return User.query.filter_by(email=email).first()
+        return db.session.scalars(select(User).filter_by(email=email)).first()
     
     @staticmethod
     def find_by_id(user_id):
-        """Find user by ID using SQLAlchemy"""
-        return User.query.get(user_id)
+        """Find user by ID, checking the session identity map before querying"""
+        return db.session.get(User, user_id)
     
     def save(self):
         """Save user to database using SQLAlchemy"""
@@ -58,9 +62,9 @@ class User(db.Model):
             db.session.add(self)
             db.session.commit()
             return True
-        except Exception as e:
+        except Exception:
             db.session.rollback()
-            print(f"Error saving user: {e}")
+            log.exception("Error saving user")
             return False
     
     def delete(self):
@@ -69,9 +73,9 @@ class User(db.Model):
             db.session.delete(self)
             db.session.commit()
             return True
-        except Exception as e:
+        except Exception:
             db.session.rollback()
-            print(f"Error deleting user: {e}")
+            log.exception("Error deleting user")
             return False
     
     def to_dict(self):
@@ -100,6 +104,9 @@ class Device(db.Model):
     location = db.Column(db.String(200))
     latitude = db.Column(db.Float)
     longitude = db.Column(db.Float)
+    # Derived from latitude/longitude on every flush off SQLite, which uses device_rtree instead;
+    # see _stamp_geohash
+    geohash = db.Column(db.String(GEOHASH_PRECISION))
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
@@ -111,6 +118,8 @@ class Device(db.Model):
         db.Index('idx_device_user_id', 'user_id'),
         db.Index('idx_device_status', 'status'),
         db.Index('idx_device_created_at', 'created_at'),
+        db.Index('idx_device_user_location', 'user_id', 'latitude', 'longitude'),
+        db.Index('idx_device_user_updated', 'user_id', 'updated_at'),
     )
 
     def __init__(self, name, user_id, description='', category='', status='lost', 
@@ -125,56 +134,210 @@ class Device(db.Model):
         self.longitude = float(longitude) if longitude is not None else None
     
     @staticmethod
-    def find_by_user_id(user_id):
-        """Find all devices belonging to a user using SQLAlchemy"""
-        return Device.query.filter_by(user_id=user_id).order_by(Device.created_at.desc()).all()
+    def find_by_id(device_id):
+        """Find device by ID, checking the session identity map before querying"""
+        return db.session.get(Device, device_id)
     
     @staticmethod
-    def find_by_id(device_id):
-        """Find device by ID using SQLAlchemy"""
-        return Device.query.get(device_id)
+    def _row_columns():
+        """The devices columns behind to_dict(), i.e. every key but owner_username"""
+        return (
+            Device.id, Device.name, Device.description, Device.category, Device.status,
+            Device.location, Device.latitude, Device.longitude, Device.user_id,
+            Device.created_at, Device.updated_at
+        )
+    
+    @staticmethod
+    def _rows_statement(criteria, after):
+        """SELECT of to_dict() columns for keyset pages, newest first, below the `after` cursor"""
+        stmt = (
+            select(*Device._row_columns(), User.username.label('owner_username'))
+            .outerjoin(User, Device.user_id == User.id)
+            .where(*criteria)
+        )
+        if after is not None:
+            stmt = stmt.where(Device.id < after)
+        return stmt.order_by(Device.id.desc())
+    
+    @staticmethod
+    def find_rows(*criteria, limit=None, after=None):
+        """Fetch one keyset page of devices as plain row mappings, skipping ORM hydration.
+        
+        Rows are newest first by ID, restricted to IDs below `after`, and carry the same
+        keys as to_dict(). Intended for read-only list endpoints.
+        """
+        stmt = Device._rows_statement(criteria, after)
+        if limit is not None:
+            stmt = stmt.limit(limit)
+        return db.session.execute(stmt).mappings().all()
+    
+    @staticmethod
+    def iter_rows(*criteria, after=None):
+        """Like find_rows(), but yields row mappings in batches from the cursor instead of loading them all"""
+        stmt = Device._rows_statement(criteria, after).execution_options(yield_per=100)
+        return db.session.execute(stmt).mappings()
+    
+    @staticmethod
+    def page_bound(*criteria, limit, after=None):
+        """ID of the last device on a keyset page when more pages follow, else None (index-only probe)"""
+        stmt = select(Device.id).where(*criteria)
+        if after is not None:
+            stmt = stmt.where(Device.id < after)
+        ids = db.session.scalars(stmt.order_by(Device.id.desc()).offset(limit - 1).limit(2)).all()
+        return ids[0] if len(ids) == 2 else None
     
     @staticmethod
-    def find_all():
-        """Find all devices using SQLAlchemy"""
-        return Device.query.order_by(Device.created_at.desc()).all()
+    def within_box(box):
+        """Criteria restricting devices to a geo.bounding_box() result"""
+        min_lat, max_lat, min_lon, max_lon = box
+        if db.engine.dialect.name == 'sqlite':
+            # Candidate IDs from the R*Tree index maintained by create_spatial_index()
+            rtree = device_rtree.c
+            box_ids = select(rtree.id).where(rtree.min_lat <= max_lat, rtree.max_lat >= min_lat)
+            if min_lon is not None:
+                box_ids = box_ids.where(rtree.min_lon <= max_lon, rtree.max_lon >= min_lon)
+            return [Device.id.in_(box_ids)]
+        
+        criteria = [Device.latitude.between(min_lat, max_lat)]
+        if min_lon is not None:
+            criteria.append(Device.longitude.between(min_lon, max_lon))
+        prefixes = geohash_cover(box)
+        if prefixes:
+            criteria.append(Device.geohash_condition(prefixes))
+        return criteria
+    
+    @staticmethod
+    def geohash_condition(prefixes):
+        """Match devices whose geohash starts with any of `prefixes`, as B-tree range scans"""
+        return or_(*(
+            and_(Device.geohash >= low, Device.geohash < high) if high is not None else Device.geohash >= low
+            for low, high in geohash_ranges(prefixes)
+        ))
+    
+    @staticmethod
+    def find_coordinates(*criteria):
+        """Fetch (id, latitude, longitude) for every matching device that has both coordinates"""
+        return db.session.execute(
+            select(Device.id, Device.latitude, Device.longitude)
+            .where(Device.latitude.isnot(None), Device.longitude.isnot(None), *criteria)
+        ).all()
+    
+    @staticmethod
+    def get_user_version(user_id):
+        """(MAX(updated_at), COUNT) over a user's devices; changes whenever one is added, edited or removed"""
+        return tuple(db.session.execute(
+            select(func.max(Device.updated_at), func.count(Device.id)).where(Device.user_id == user_id)
+        ).one())
     
     @staticmethod
     def get_user_stats(user_id):
         """Get device statistics for a user using SQLAlchemy"""
         try:
-            stats = db.session.query(
-                func.count(Device.id).label('total'),
-                func.sum(db.case((Device.status == 'lost', 1), else_=0)).label('lost'),
-                func.sum(db.case((Device.status == 'found', 1), else_=0)).label('found')
-            ).filter(Device.user_id == user_id).first()
+            by_status = dict(db.session.execute(
+                select(Device.status, func.count(Device.id))
+                .where(Device.user_id == user_id)
+                .group_by(Device.status)
+            ).all())
             
             return {
-                'total': int(stats.total or 0),
-                'lost': int(stats.lost or 0),
-                'found': int(stats.found or 0)
+                'total': sum(by_status.values()),
+                'lost': by_status.get('lost', 0),
+                'found': by_status.get('found', 0)
             }
-        except Exception as e:
-            print(f"Error getting user stats: {e}")
+        except Exception:
+            log.exception("Error getting user stats")
             return {'total': 0, 'lost': 0, 'found': 0}
     
     @staticmethod
-    def search_devices(query, user_id=None):
-        """Search devices by name, description, or location using SQLAlchemy"""
-        search = f"%{query}%"
-        devices_query = Device.query.filter(
-            db.or_(
-                Device.name.like(search),
-                Device.description.like(search),
-                Device.location.like(search),
-                Device.category.like(search)
+    def get_site_stats():
+        """Site-wide user count and device counts by status, fetched in a single round trip"""
+        rows = db.session.execute(union_all(
+            select(literal('users'), literal(None, db.String), func.count(User.id)),
+            select(literal('devices'), Device.status, func.count(Device.id)).group_by(Device.status)
+        )).all()
+        
+        user_count = 0
+        by_status = {}
+        for kind, status, count in rows:
+            if kind == 'users':
+                user_count = count
+            else:
+                by_status[status] = count
+        
+        return {
+            'users': user_count,
+            'devices': sum(by_status.values()),
+            'lost': by_status.get('lost', 0),
+            'found': by_status.get('found', 0)
+        }
+    
+    @staticmethod
+    def search_document():
+        """PostgreSQL text-search document over name, description, category and location.
+        
+        Literals are inlined so the expression matches the GIN index built from it.
+        """
+        c = Device.__table__.c
+        empty, space = text("''"), text("' '")
+        document = func.coalesce(c.name, empty)
+        for field in (c.description, c.category, c.location):
+            document = document + space + func.coalesce(field, empty)
+        return postgresql.to_tsvector(text("'simple'"), document)
+    
+    @staticmethod
+    def search_condition(query):
+        """Filter matching devices by name, description, category or location"""
+        if db.engine.dialect.name == 'postgresql':
+            # Indexed full-text match instead of a sequential LIKE scan
+            return Device.search_document().op('@@')(
+                postgresql.websearch_to_tsquery(text("'simple'"), query)
             )
+        search = f"%{query}%"
+        return db.or_(
+            Device.name.like(search),
+            Device.description.like(search),
+            Device.location.like(search),
+            Device.category.like(search)
         )
+    
+    @staticmethod
+    def update_status_for_owner(device_id, user_id, new_status):
+        """Set the status of a user's device in a single UPDATE ... RETURNING.
         
-        if user_id:
-            devices_query = devices_query.filter(Device.user_id == user_id)
+        Returns the updated row as a plain mapping with the to_dict() keys except
+        owner_username, or None if no device with that ID belongs to the user. A mapping
+        is not expired by the commit, so reading it costs no further queries.
+        """
+        try:
+            row = db.session.execute(
+                update(Device)
+                .where(Device.id == device_id, Device.user_id == user_id)
+                .values(status=new_status)
+                .returning(*Device._row_columns())
+            ).mappings().one_or_none()
+            db.session.commit()
+            return row
+        except Exception:
+            db.session.rollback()
+            raise
+    
+    @staticmethod
+    def delete_for_owner(device_id, user_id):
+        """Delete a user's device in a single DELETE ... RETURNING.
         
-        return devices_query.order_by(Device.created_at.desc()).all()
+        Returns False if no device with that ID belongs to the user.
+        """
+        try:
+            deleted_id = db.session.execute(
+                delete(Device)
+                .where(Device.id == device_id, Device.user_id == user_id)
+                .returning(Device.id)
+            ).scalar_one_or_none()
+            db.session.commit()
+            return deleted_id is not None
+        except Exception:
+            db.session.rollback()
+            raise
     
     def save(self):
         """Save device to database using SQLAlchemy"""
@@ -182,9 +345,9 @@ class Device(db.Model):
             db.session.add(self)
             db.session.commit()
             return True
-        except Exception as e:
+        except Exception:
             db.session.rollback()
-            print(f"Error saving device: {e}")
+            log.exception("Error saving device")
             return False
     
     def delete(self):
@@ -193,16 +356,15 @@ class Device(db.Model):
             db.session.delete(self)
             db.session.commit()
             return True
-        except Exception as e:
+        except Exception:
             db.session.rollback()
-            print(f"Error deleting device: {e}")
+            log.exception("Error deleting device")
             return False
     
     def update_status(self, new_status):
         """Update device status using SQLAlchemy"""
         if new_status in ['lost', 'found']:
             self.status = new_status
-            self.updated_at = datetime.utcnow()
             return self.save()
         return False
     
@@ -224,4 +386,85 @@ class Device(db.Model):
         }
 
     def __repr__(self):
-        return f'<Device {self.name} ({self.status})>'
\ No newline at end of file
+        return f'<Device {self.name} ({self.status})>'
+
+# GIN index backing full-text device search; to_tsvector only exists on PostgreSQL
+db.Index('idx_device_search', Device.search_document(), postgresql_using='gin').ddl_if(dialect='postgresql')
+
+# Geohash prefix index for within_box(); SQLite answers those queries from device_rtree
+db.Index('idx_device_user_geohash', Device.user_id, Device.geohash).ddl_if(
+    callable_=lambda ddl, target, bind, dialect, **kw: dialect.name != 'sqlite'
+)
+
+def _geohash_of(latitude, longitude):
+    """Stored geohash for a pair of coordinates, or None when either is missing"""
+    if latitude is None or longitude is None:
+        return None
+    return geohash_encode(latitude, longitude)
+
+@event.listens_for(Device, 'before_insert')
+@event.listens_for(Device, 'before_update')
+def _stamp_geohash(mapper, connection, target):
+    """Keep the geohash column in step with the device's coordinates"""
+    if connection.dialect.name == 'sqlite':
+        return
+    target.geohash = _geohash_of(target.latitude, target.longitude)
+
+def add_geohash_column():
+    """Add and backfill devices.geohash on databases created before the column existed.
+    
+    SQLite only gets the bare column, which stays NULL there; see _stamp_geohash.
+    """
+    with db.engine.begin() as conn:
+        if any(col['name'] == 'geohash' for col in inspect(conn).get_columns('devices')):
+            return
+        conn.execute(text(f"ALTER TABLE devices ADD COLUMN geohash VARCHAR({GEOHASH_PRECISION})"))
+        if conn.dialect.name == 'sqlite':
+            return
+        rows = conn.execute(select(Device.id, Device.latitude, Device.longitude).where(
+            Device.latitude.isnot(None), Device.longitude.isnot(None)
+        )).all()
+        if rows:
+            conn.execute(
+                text("UPDATE devices SET geohash = :geohash WHERE id = :id"),
+                [{'id': row.id, 'geohash': _geohash_of(row.latitude, row.longitude)} for row in rows]
+            )
+        for index in Device.__table__.indexes:
+            if index.name == 'idx_device_user_geohash':
+                index.create(conn, checkfirst=True)
+
+# SQLite R*Tree over device coordinates, kept in step with the devices table by triggers
+device_rtree = table('device_rtree', column('id'), column('min_lat'), column('max_lat'),
+                     column('min_lon'), column('max_lon'))
+
+_DEVICE_RTREE_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS device_rtree USING rtree(id, min_lat, max_lat, min_lon, max_lon)",
+    """CREATE TRIGGER IF NOT EXISTS device_rtree_insert AFTER INSERT ON devices
+       WHEN NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL BEGIN
+           INSERT INTO device_rtree VALUES (NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude);
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS device_rtree_update AFTER UPDATE OF latitude, longitude ON devices BEGIN
+           DELETE FROM device_rtree WHERE id = OLD.id;
+           INSERT INTO device_rtree SELECT NEW.id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude
+           WHERE NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL;
+       END""",
+    """CREATE TRIGGER IF NOT EXISTS device_rtree_delete AFTER DELETE ON devices BEGIN
+           DELETE FROM device_rtree WHERE id = OLD.id;
+       END""",
+)
+
+def create_spatial_index():
+    """Create the SQLite R*Tree device index and its triggers, backfilling it on first creation"""
+    if db.engine.dialect.name != 'sqlite':
+        return
+    with db.engine.begin() as conn:
+        exists = conn.scalar(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'device_rtree'"
+        ))
+        for statement in _DEVICE_RTREE_DDL:
+            conn.execute(text(statement))
+        if not exists:
+            conn.execute(text(
+                "INSERT INTO device_rtree SELECT id, latitude, latitude, longitude, longitude "
+                "FROM devices WHERE latitude IS NOT NULL AND longitude IS NOT NULL"
+            ))
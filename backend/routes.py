@@ -1,317 +1,385 @@
-from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import db, Device, User
+from flask import Blueprint, current_app, request, stream_with_context, g
+from flask_jwt_extended import verify_jwt_in_request, get_jwt, get_jwt_identity
+from cachetools import TTLCache, cached
+from pydantic import ValidationError
+from collections import namedtuple
+from threading import Lock, RLock
+from models import Device, User
+from schemas import DeviceIn, DeviceUpdate, error_message
 from datetime import datetime
-import math
+from geo import bounding_box, radius_distances
+import logging
+import numpy as np
+import orjson
+import xxhash
 
 api = Blueprint('api', __name__)
+log = logging.getLogger(__name__)
 
-def calculate_distance(lat1, lon1, lat2, lon2):
-    """Calculate distance between two points using Haversine formula"""
-    if not all([lat1, lon1, lat2, lon2]):
-        return float('inf')
+# Short-lived cache of JWT identity -> user snapshot, so authenticated
+# requests skip the users SELECT. Plain tuples are cached rather than ORM
+# instances, which are bound to the session that loaded them.
+CurrentUser = namedtuple('CurrentUser', ['id', 'username', 'is_admin'])
+_user_cache = TTLCache(maxsize=10_000, ttl=30)
+_user_cache_lock = Lock()
+
+def _current_user():
+    """Resolve the JWT to a user snapshot, or None if the user does not exist.
+    
+    Built from the token's claims when it carries a uid; older tokens fall back to the
+    cached username lookup. The result is memoized on `g` for the rest of the request.
+    """
+    if 'current_user' in g:
+        return g.current_user
+    username = get_jwt_identity()
+    
+    # Tokens issued with a uid claim identify the user without any lookup
+    claims = get_jwt()
+    if 'uid' in claims:
+        return CurrentUser(claims['uid'], username, claims.get('is_admin', False))
     
-    # Convert latitude and longitude from degrees to radians
-    lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
+    with _user_cache_lock:
+        snapshot = _user_cache.get(username)
+    if snapshot is not None:
+        return snapshot
+    
+    user = User.find_by_username(username)
+    if not user:
+        return None
+    
+    snapshot = CurrentUser(user.id, user.username, user.is_admin)
+    with _user_cache_lock:
+        _user_cache[username] = snapshot
+    return snapshot
+
+def invalidate_user_cache(username):
+    """Drop a cached user snapshot after the user row changes"""
+    with _user_cache_lock:
+        _user_cache.pop(username, None)
+
+@api.before_request
+def _limit_body_size():
+    """Reject request bodies over MAX_CONTENT_LENGTH with 413 before the handler runs.
     
-    # Haversine formula
-    dlat = lat2 - lat1
-    dlon = lon2 - lon1
-    a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
-    c = 2 * math.asin(math.sqrt(a))
+    A chunked body has no Content-Length to check, so it is read (and cached) here. Werkzeug
+    stops such a read silently at the limit, so a body that fills it is treated as too large.
+    """
+    if request.content_length is not None:
+        if request.content_length > request.max_content_length:
+            return _json({"message": "Payload too large"}, 413)
+    elif request.method in ('POST', 'PUT', 'PATCH'):
+        if len(request.get_data()) >= request.max_content_length:
+            return _json({"message": "Payload too large"}, 413)
+
+@api.before_request
+def _require_json():
+    """Reject non-JSON bodies on writes with 415.
     
-    # Radius of Earth in kilometers
-    r = 6371
-    return c * r
+    A declared body is checked without reading it; a chunked one was already read and
+    cached by _limit_body_size.
+    """
+    if (request.method in ('POST', 'PUT', 'PATCH') and not request.is_json
+            and (request.content_length or request.get_data())):
+        return _json({"message": "Content-Type must be application/json"}, 415)
+
+# Endpoints served without a JWT
+_PUBLIC_ENDPOINTS = frozenset(('api.health',))
+# Endpoints authorized from the token's claims alone, without resolving the user
+_CLAIMS_ONLY_ENDPOINTS = frozenset(('api.admin_get_all_devices', 'api.admin_get_stats'))
+
+@api.before_request
+def _auth_gate():
+    """Verify the JWT and resolve the caller into g.current_user once for every protected endpoint"""
+    if request.method == 'OPTIONS' or request.endpoint in _PUBLIC_ENDPOINTS:
+        return None
+    # Invalid or missing tokens raise here and get flask_jwt_extended's usual 401 responses
+    verify_jwt_in_request()
+    if request.endpoint in _CLAIMS_ONLY_ENDPOINTS:
+        return None
+    g.current_user = _current_user()
+    if g.current_user is None:
+        return _json({"message": "User not found"}, 404)
+
+def _get_json():
+    """Parse the request body with orjson, returning None for empty, malformed or non-object JSON"""
+    raw = request.get_data(cache=False)
+    if not raw:
+        return None
+    try:
+        data = orjson.loads(raw)
+    except orjson.JSONDecodeError:
+        return None
+    return data if isinstance(data, dict) else None
+
+# Keyset pagination for device lists
+_DEFAULT_PAGE_SIZE = 50
+_MAX_PAGE_SIZE = 200
+
+def _limit_arg():
+    """Read the ?limit= argument, clamped to the page size cap"""
+    limit = request.args.get('limit', _DEFAULT_PAGE_SIZE, type=int)
+    return max(1, min(limit, _MAX_PAGE_SIZE))
+
+def _page_args():
+    """Read the ?limit= and ?after= pagination arguments"""
+    return _limit_arg(), request.args.get('after', type=int)
+
+def _page(rows, limit):
+    """Build a page body from up to limit + 1 device rows; `next` is the cursor for the following page"""
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "items": [dict(row) for row in rows],
+        "next": rows[-1]['id'] if has_more else None
+    }
+
+# Rows serialized per chunk when streaming a page
+_STREAM_BATCH = 50
+
+def _stream_page(rows, next_cursor):
+    """Yield the same {"items", "next"} body as _page(), serializing rows in batches as they arrive"""
+    yield b'{"items":['
+    batch = []
+    first = True
+    for row in rows:
+        batch.append(orjson.dumps(dict(row)))
+        if len(batch) == _STREAM_BATCH:
+            yield (b'' if first else b',') + b','.join(batch)
+            batch, first = [], False
+    if batch:
+        yield (b'' if first else b',') + b','.join(batch)
+    yield b'],"next":' + orjson.dumps(next_cursor) + b'}'
+
+# Prebuilt so responses skip mimetype/charset negotiation
+_JSON_HEADERS = {'Content-Type': 'application/json'}
+
+def _json(obj, status=200):
+    """Serialize a response body with orjson straight into a response, bypassing jsonify"""
+    return current_app.response_class(orjson.dumps(obj), status=status, headers=_JSON_HEADERS)
+
+def _etag_matches(etag):
+    """Weak If-None-Match check that also accepts the tag as Flask-Compress rewrites it ("<tag>:br")"""
+    if_none_match = request.if_none_match
+    if if_none_match.star_tag:
+        return True
+    return any(tag.split(':', 1)[0] == etag for tag in if_none_match.as_set(include_weak=True))
+
+def _etag_json(obj):
+    """Like _json(), but tagged with a weak xxhash ETag; answers 304 when If-None-Match matches"""
+    body = orjson.dumps(obj)
+    etag = '%x' % xxhash.xxh3_64_intdigest(body)
+    if _etag_matches(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = current_app.response_class(body, headers=_JSON_HEADERS)
+    response.set_etag(etag, weak=True)
+    return response
+
+def _versioned_json(version, build):
+    """Weak-ETag a response from a cheap version of its data instead of hashing the body.
+    
+    The tag covers `version` and the request URL, so a matching If-None-Match gets a 304
+    before build() runs; otherwise build()'s result is serialized under the same tag.
+    """
+    key = '|'.join(map(str, (request.full_path, *version)))
+    etag = '%x' % xxhash.xxh3_64_intdigest(key.encode())
+    if _etag_matches(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = _json(build())
+    response.set_etag(etag, weak=True)
+    return response
+
+_VALID_STATUS = frozenset(('lost', 'found'))
+
+def _within_radius(lat, lng, radius, limit, *criteria):
+    """The `limit` nearest devices within `radius` km of (lat, lng), nearest first, each carrying its distance"""
+    # Indexed bounding-box prune in SQL; the exact distance is computed below
+    coords = Device.find_coordinates(*criteria, *Device.within_box(bounding_box(lat, lng, radius)))
+    if not coords:
+        return []
+    count = len(coords)
+    ids = np.fromiter((row[0] for row in coords), dtype=np.int64, count=count)
+    # float32 is ~1 m of precision, far below the 10 m the distances are rounded to
+    lats = np.fromiter((row[1] for row in coords), dtype=np.float32, count=count)
+    lons = np.fromiter((row[2] for row in coords), dtype=np.float32, count=count)
+    distances = radius_distances(lat, lng, lats, lons, radius)
+    
+    mask = distances <= radius
+    ids, distances = ids[mask], distances[mask]
+    if distances.size > limit:
+        # Partial selection of the k nearest in linear time; only those k get sorted
+        top = np.argpartition(distances, limit - 1)[:limit]
+        ids, distances = ids[top], distances[top]
+    order = np.argsort(distances, kind='stable')
+    
+    # Only the devices returned are loaded in full
+    rows = {row['id']: row for row in Device.find_rows(Device.id.in_(ids.tolist()))}
+    return [dict(rows[device_id], distance=round(distance, 2))
+            for device_id, distance in zip(ids[order].tolist(), distances[order].tolist())]
+
+@cached(cache=TTLCache(maxsize=1, ttl=5), lock=RLock())
+def _global_counts():
+    """Site-wide user and device counts, shared by /health and /admin/stats.
+    
+    Cached per process for a few seconds so polling dashboards and health checks do not
+    rescan both tables on every request; figures may lag writes by up to the TTL.
+    """
+    return Device.get_site_stats()
 
 @api.route("/health", methods=["GET"])
 def health():
     """Health check endpoint"""
+    timestamp = datetime.utcnow().isoformat()
     try:
-        # Test database connection
-        user_count = User.query.count()
-        device_count = Device.query.count()
+        counts = _global_counts()
         
-        return jsonify({
+        return _json({
             "status": "healthy",
             "database": "connected",
             "stats": {
-                "users": user_count,
-                "devices": device_count
+                "users": counts['users'],
+                "devices": counts['devices']
             },
-            "timestamp": datetime.utcnow().isoformat()
-        }), 200
+            "timestamp": timestamp
+        })
     except Exception as e:
-        return jsonify({
+        return _json({
             "status": "unhealthy", 
             "error": str(e),
-            "timestamp": datetime.utcnow().isoformat()
-        }), 500
+            "timestamp": timestamp
+        }, 500)
 
 @api.route("/devices", methods=["GET"])
-@jwt_required()
 def get_devices():
     """Get all devices for current user"""
     try:
-        current_user = User.find_by_username(get_jwt_identity())
-        if not current_user:
-            return jsonify({"message": "User not found"}), 404
-        
-        devices = Device.find_by_user_id(current_user.id)
-        return jsonify([device.to_dict() for device in devices]), 200
+        limit, after = _page_args()
+        user_id = g.current_user.id
+        return _versioned_json(
+            Device.get_user_version(user_id),
+            lambda: _page(Device.find_rows(Device.user_id == user_id, limit=limit + 1, after=after), limit)
+        )
         
-    except Exception as e:
-        print(f"Get devices error: {e}")
-        return jsonify({"error": "Failed to fetch devices"}), 500
+    except Exception:
+        log.exception("Get devices error")
+        return _json({"error": "Failed to fetch devices"}, 500)
 
 @api.route("/devices", methods=["POST"])
-@jwt_required()
 def add_device():
     """Add a new device"""
     try:
-        current_user = User.find_by_username(get_jwt_identity())
-        if not current_user:
-            return jsonify({"message": "User not found"}), 404
-        
-        data = request.get_json()
-        
-        # Validate required fields
-        if not data or not data.get('name'):
-            return jsonify({"message": "Device name is required"}), 400
-        
-        # Handle different field names from frontend
-        name = data.get('name', '').strip()
-        description = data.get('description', data.get('device_type', '')).strip()
-        category = data.get('category', data.get('device_type', '')).strip()
-        location = data.get('location', data.get('location_text', '')).strip()
-        status = data.get('status', 'lost')
-        
-        # Validate coordinates if provided
-        latitude = data.get('latitude')
-        longitude = data.get('longitude')
-        
-        if latitude is not None and latitude != '':
-            try:
-                latitude = float(latitude)
-                if not (-90 <= latitude <= 90):
-                    return jsonify({"message": "Latitude must be between -90 and 90"}), 400
-            except (ValueError, TypeError):
-                return jsonify({"message": "Invalid latitude format"}), 400
-        else:
-            latitude = None
-        
-        if longitude is not None and longitude != '':
-            try:
-                longitude = float(longitude)
-                if not (-180 <= longitude <= 180):
-                    return jsonify({"message": "Longitude must be between -180 and 180"}), 400
-            except (ValueError, TypeError):
-                return jsonify({"message": "Invalid longitude format"}), 400
-        else:
-            longitude = None
-        
-        # Validate status
-        if status not in ['lost', 'found']:
-            return jsonify({"message": "Status must be 'lost' or 'found'"}), 400
+        try:
+            # Decode and validate in one pass over the raw body
+            payload = DeviceIn.model_validate_json(request.get_data(cache=False) or b'{}')
+        except ValidationError as e:
+            return _json({"message": error_message(e)}, 400)
         
         # Create new device
-        device = Device(
-            name=name,
-            user_id=current_user.id,
-            description=description,
-            category=category,
-            status=status,
-            location=location,
-            latitude=latitude,
-            longitude=longitude
-        )
+        device = Device(user_id=g.current_user.id, **payload.model_dump())
         
         if device.save():
-            return jsonify(device.to_dict()), 201
+            return _json(device.to_dict(), 201)
         else:
-            return jsonify({"message": "Failed to create device"}), 500
+            return _json({"message": "Failed to create device"}, 500)
             
-    except Exception as e:
-        print(f"Add device error: {e}")
-        return jsonify({"error": "Failed to create device"}), 500
+    except Exception:
+        log.exception("Add device error")
+        return _json({"error": "Failed to create device"}, 500)
 
 @api.route("/devices/<int:device_id>", methods=["PUT"])
-@jwt_required()
 def update_device(device_id):
     """Update an existing device"""
     try:
-        current_user = User.find_by_username(get_jwt_identity())
-        if not current_user:
-            return jsonify({"message": "User not found"}), 404
-        
         # Find device
         device = Device.find_by_id(device_id)
         if not device:
-            return jsonify({"message": "Device not found"}), 404
+            return _json({"message": "Device not found"}, 404)
         
         # Check ownership
-        if device.user_id != current_user.id:
-            return jsonify({"message": "Unauthorized - you can only update your own devices"}), 403
-        
-        data = request.get_json()
-        if not data:
-            return jsonify({"message": "No data provided"}), 400
-        
-        # Update device fields
-        if 'name' in data:
-            if not data['name'].strip():
-                return jsonify({"message": "Device name cannot be empty"}), 400
-            device.name = data['name'].strip()
-        
-        if 'description' in data:
-            device.description = data['description'].strip()
-        
-        # Handle device_type as category for backward compatibility
-        if 'device_type' in data:
-            device.category = data['device_type'].strip()
-        
-        if 'category' in data:
-            device.category = data['category'].strip()
-        
-        # Handle both location and location_text
-        if 'location' in data:
-            device.location = data['location'].strip()
-        elif 'location_text' in data:
-            device.location = data['location_text'].strip()
-        
-        if 'status' in data:
-            if data['status'] not in ['lost', 'found']:
-                return jsonify({"message": "Status must be 'lost' or 'found'"}), 400
-            device.status = data['status']
-        
-        # Update coordinates
-        if 'latitude' in data:
-            if data['latitude'] is not None and data['latitude'] != '':
-                try:
-                    latitude = float(data['latitude'])
-                    if not (-90 <= latitude <= 90):
-                        return jsonify({"message": "Latitude must be between -90 and 90"}), 400
-                    device.latitude = latitude
-                except (ValueError, TypeError):
-                    return jsonify({"message": "Invalid latitude format"}), 400
-            else:
-                device.latitude = None
-        
-        if 'longitude' in data:
-            if data['longitude'] is not None and data['longitude'] != '':
-                try:
-                    longitude = float(data['longitude'])
-                    if not (-180 <= longitude <= 180):
-                        return jsonify({"message": "Longitude must be between -180 and 180"}), 400
-                    device.longitude = longitude
-                except (ValueError, TypeError):
-                    return jsonify({"message": "Invalid longitude format"}), 400
-            else:
-                device.longitude = None
-        
-        # Update timestamp
-        device.updated_at = datetime.utcnow()
+        if device.user_id != g.current_user.id:
+            return _json({"message": "Unauthorized - you can only update your own devices"}, 403)
+        
+        raw = request.get_data(cache=False)
+        if not raw:
+            return _json({"message": "No data provided"}, 400)
+        
+        try:
+            changes = DeviceUpdate.model_validate_json(raw).changes()
+        except ValidationError as e:
+            return _json({"message": error_message(e)}, 400)
+        if not changes:
+            return _json({"message": "No data provided"}, 400)
+        
+        for field, value in changes.items():
+            setattr(device, field, value)
         
         # Save changes
         if device.save():
-            return jsonify(device.to_dict()), 200
+            return _json(device.to_dict())
         else:
-            return jsonify({"message": "Failed to update device"}), 500
+            return _json({"message": "Failed to update device"}, 500)
             
-    except Exception as e:
-        print(f"Update device error: {e}")
-        return jsonify({"error": "Failed to update device"}), 500
+    except Exception:
+        log.exception("Update device error")
+        return _json({"error": "Failed to update device"}, 500)
 
 @api.route("/devices/<int:device_id>", methods=["DELETE"])
-@jwt_required()
 def delete_device(device_id):
     """Delete a device"""
     try:
-        current_user = User.find_by_username(get_jwt_identity())
-        if not current_user:
-            return jsonify({"message": "User not found"}), 404
+        # Ownership is part of the DELETE itself, so there is no separate lookup
+        if not Device.delete_for_owner(device_id, g.current_user.id):
+            return _json({"message": "Device not found"}, 404)
         
-        # Find device
-        device = Device.find_by_id(device_id)
-        if not device:
-            return jsonify({"message": "Device not found"}), 404
-        
-        # Check ownership
-        if device.user_id != current_user.id:
-            return jsonify({"message": "Unauthorized - you can only delete your own devices"}), 403
-        
-        # Delete device
-        if device.delete():
-            return jsonify({"message": "Device deleted successfully"}), 200
-        else:
-            return jsonify({"message": "Failed to delete device"}), 500
+        return _json({"message": "Device deleted successfully"})
             
-    except Exception as e:
-        print(f"Delete device error: {e}")
-        return jsonify({"error": "Failed to delete device"}), 500
+    except Exception:
+        log.exception("Delete device error")
+        return _json({"error": "Failed to delete device"}, 500)
 
 @api.route("/devices/stats", methods=["GET"])
-@jwt_required()
 def get_device_stats():
     """Get device statistics for current user"""
     try:
-        current_user = User.find_by_username(get_jwt_identity())
-        if not current_user:
-            return jsonify({"message": "User not found"}), 404
+        user_id = g.current_user.id
+        return _versioned_json(Device.get_user_version(user_id), lambda: Device.get_user_stats(user_id))
         
-        stats = Device.get_user_stats(current_user.id)
-        return jsonify(stats), 200
-        
-    except Exception as e:
-        print(f"Get stats error: {e}")
-        return jsonify({"error": "Failed to fetch statistics"}), 500
+    except Exception:
+        log.exception("Get stats error")
+        return _json({"error": "Failed to fetch statistics"}, 500)
 
 @api.route("/devices/<int:device_id>/status", methods=["PATCH"])
-@jwt_required()
 def update_device_status(device_id):
     """Update device status only"""
     try:
-        current_user = User.find_by_username(get_jwt_identity())
-        if not current_user:
-            return jsonify({"message": "User not found"}), 404
-        
-        device = Device.find_by_id(device_id)
-        if not device:
-            return jsonify({"message": "Device not found"}), 404
-        
-        # Check ownership
-        if device.user_id != current_user.id:
-            return jsonify({"message": "Unauthorized"}), 403
-        
-        data = request.get_json()
+        data = _get_json()
         if not data or 'status' not in data:
-            return jsonify({"message": "Status is required"}), 400
+            return _json({"message": "Status is required"}, 400)
         
         new_status = data['status']
-        if new_status not in ['lost', 'found']:
-            return jsonify({"message": "Status must be 'lost' or 'found'"}), 400
-        
-        if device.update_status(new_status):
-            return jsonify({
-                "message": f"Device status updated to {new_status}",
-                "device": device.to_dict()
-            }), 200
-        else:
-            return jsonify({"message": "Failed to update status"}), 500
+        if new_status not in _VALID_STATUS:
+            return _json({"message": "Status must be 'lost' or 'found'"}, 400)
+        
+        # Ownership is part of the UPDATE itself, so there is no separate lookup
+        row = Device.update_status_for_owner(device_id, g.current_user.id, new_status)
+        if row is None:
+            return _json({"message": "Device not found"}, 404)
+        
+        # The owner is the caller, so the username needs no join or lazy load
+        return _json({
+            "message": f"Device status updated to {new_status}",
+            "device": dict(row, owner_username=g.current_user.username)
+        })
             
-    except Exception as e:
-        print(f"Update status error: {e}")
-        return jsonify({"error": "Failed to update device status"}), 500
+    except Exception:
+        log.exception("Update status error")
+        return _json({"error": "Failed to update device status"}, 500)
 
 @api.route("/devices/search", methods=["GET"])
-@jwt_required()
 def search_devices():
     """Search devices by query or location"""
     try:
-        current_user = User.find_by_username(get_jwt_identity())
-        if not current_user:
-            return jsonify({"message": "User not found"}), 404
-        
         query = request.args.get('q', '').strip()
         latitude = request.args.get('lat')
         longitude = request.args.get('lng')
@@ -319,8 +387,12 @@ def search_devices():
         
         if query:
             # Text-based search
-            devices = Device.search_devices(query, current_user.id)
-            return jsonify([device.to_dict() for device in devices]), 200
+            limit, after = _page_args()
+            rows = Device.find_rows(
+                Device.search_condition(query), Device.user_id == g.current_user.id,
+                limit=limit + 1, after=after
+            )
+            return _json(_page(rows, limit))
         
         elif latitude and longitude:
             # Location-based search
@@ -329,177 +401,130 @@ def search_devices():
                 lng = float(longitude)
                 radius = float(radius)
                 
-                # Get all user devices with coordinates
-                devices = Device.find_by_user_id(current_user.id)
-                nearby_devices = []
-                
-                for device in devices:
-                    if device.latitude and device.longitude:
-                        distance = calculate_distance(lat, lng, device.latitude, device.longitude)
-                        if distance <= radius:
-                            device_dict = device.to_dict()
-                            device_dict['distance'] = round(distance, 2)
-                            nearby_devices.append(device_dict)
-                
-                # Sort by distance
-                nearby_devices.sort(key=lambda x: x['distance'])
-                return jsonify(nearby_devices), 200
+                return _json(_within_radius(lat, lng, radius, _limit_arg(), Device.user_id == g.current_user.id))
                 
             except (ValueError, TypeError):
-                return jsonify({"message": "Invalid coordinates"}), 400
+                return _json({"message": "Invalid coordinates"}, 400)
         
         else:
-            return jsonify({"message": "Search query or coordinates required"}), 400
+            return _json({"message": "Search query or coordinates required"}, 400)
         
-    except Exception as e:
-        print(f"Search devices error: {e}")
-        return jsonify({"error": "Failed to search devices"}), 500
+    except Exception:
+        log.exception("Search devices error")
+        return _json({"error": "Failed to search devices"}, 500)
 
 @api.route("/devices/<int:device_id>/track", methods=["POST"])
-@jwt_required()
 def start_device_tracking(device_id):
     """Start tracking a lost device"""
     try:
-        current_user = User.find_by_username(get_jwt_identity())
-        if not current_user:
-            return jsonify({"message": "User not found"}), 404
-        
         device = Device.find_by_id(device_id)
         if not device:
-            return jsonify({"message": "Device not found"}), 404
+            return _json({"message": "Device not found"}, 404)
         
         # Check ownership
-        if device.user_id != current_user.id:
-            return jsonify({"message": "Unauthorized"}), 403
+        if device.user_id != g.current_user.id:
+            return _json({"message": "Unauthorized"}, 403)
         
         if device.status != 'lost':
-            return jsonify({"message": "Only lost devices can be tracked"}), 400
+            return _json({"message": "Only lost devices can be tracked"}, 400)
         
-        if not device.latitude or not device.longitude:
-            return jsonify({"message": "Device location required for tracking"}), 400
+        if device.latitude is None or device.longitude is None:
+            return _json({"message": "Device location required for tracking"}, 400)
         
         # In a real application, this would initiate actual GPS tracking
         # For now, we'll just return success and let the frontend handle simulation
         
-        return jsonify({
+        return _json({
             "message": "Tracking started successfully",
             "device": device.to_dict(),
             "tracking_id": f"track_{device_id}_{int(datetime.utcnow().timestamp())}"
-        }), 200
+        })
         
-    except Exception as e:
-        print(f"Start tracking error: {e}")
-        return jsonify({"error": "Failed to start tracking"}), 500
+    except Exception:
+        log.exception("Start tracking error")
+        return _json({"error": "Failed to start tracking"}, 500)
 
 @api.route("/devices/<int:device_id>/track", methods=["DELETE"])
-@jwt_required()
 def stop_device_tracking(device_id):
     """Stop tracking a device"""
     try:
-        current_user = User.find_by_username(get_jwt_identity())
-        if not current_user:
-            return jsonify({"message": "User not found"}), 404
-        
         device = Device.find_by_id(device_id)
         if not device:
-            return jsonify({"message": "Device not found"}), 404
+            return _json({"message": "Device not found"}, 404)
         
         # Check ownership
-        if device.user_id != current_user.id:
-            return jsonify({"message": "Unauthorized"}), 403
+        if device.user_id != g.current_user.id:
+            return _json({"message": "Unauthorized"}, 403)
         
-        return jsonify({"message": "Tracking stopped successfully"}), 200
+        return _json({"message": "Tracking stopped successfully"})
         
-    except Exception as e:
-        print(f"Stop tracking error: {e}")
-        return jsonify({"error": "Failed to stop tracking"}), 500
+    except Exception:
+        log.exception("Stop tracking error")
+        return _json({"error": "Failed to stop tracking"}, 500)
 
 @api.route("/devices/nearby", methods=["GET"])
-@jwt_required()
 def get_nearby_devices():
     """Get devices near a specific location"""
     try:
-        current_user = User.find_by_username(get_jwt_identity())
-        if not current_user:
-            return jsonify({"message": "User not found"}), 404
-        
         latitude = request.args.get('lat')
         longitude = request.args.get('lng')
         radius = request.args.get('radius', 5)  # Default 5km radius
         status = request.args.get('status')  # Optional filter by status
         
         if not latitude or not longitude:
-            return jsonify({"message": "Latitude and longitude required"}), 400
+            return _json({"message": "Latitude and longitude required"}, 400)
         
         try:
             lat = float(latitude)
             lng = float(longitude)
             radius = float(radius)
         except (ValueError, TypeError):
-            return jsonify({"message": "Invalid coordinates"}), 400
+            return _json({"message": "Invalid coordinates"}, 400)
         
-        # Get user devices
-        query = Device.query.filter_by(user_id=current_user.id)
-        if status and status in ['lost', 'found']:
-            query = query.filter_by(status=status)
+        criteria = [Device.user_id == g.current_user.id]
+        if status in _VALID_STATUS:
+            criteria.append(Device.status == status)
         
-        devices = query.all()
-        nearby_devices = []
+        return _json(_within_radius(lat, lng, radius, _limit_arg(), *criteria))
         
-        for device in devices:
-            if device.latitude and device.longitude:
-                distance = calculate_distance(lat, lng, device.latitude, device.longitude)
-                if distance <= radius:
-                    device_dict = device.to_dict()
-                    device_dict['distance'] = round(distance, 2)
-                    nearby_devices.append(device_dict)
-        
-        # Sort by distance
-        nearby_devices.sort(key=lambda x: x['distance'])
-        return jsonify(nearby_devices), 200
-        
-    except Exception as e:
-        print(f"Get nearby devices error: {e}")
-        return jsonify({"error": "Failed to get nearby devices"}), 500
+    except Exception:
+        log.exception("Get nearby devices error")
+        return _json({"error": "Failed to get nearby devices"}, 500)
 
 # Admin routes
 @api.route("/admin/devices", methods=["GET"])
-@jwt_required()
 def admin_get_all_devices():
     """Get all devices (admin only)"""
     try:
-        current_user = User.find_by_username(get_jwt_identity())
-        if not current_user or not current_user.is_admin:
-            return jsonify({"message": "Admin access required"}), 403
+        if not get_jwt().get('is_admin'):
+            return _json({"message": "Admin access required"}, 403)
         
-        devices = Device.find_all()
-        return jsonify([device.to_dict() for device in devices]), 200
+        limit, after = _page_args()
+        # Fix the page's extent up front so the cursor can go in a header before the body streams
+        next_cursor = Device.page_bound(limit=limit, after=after)
+        criteria = [] if next_cursor is None else [Device.id >= next_cursor]
+        rows = Device.iter_rows(*criteria, after=after)
         
-    except Exception as e:
-        print(f"Admin get devices error: {e}")
-        return jsonify({"error": "Failed to fetch all devices"}), 500
+        response = current_app.response_class(
+            stream_with_context(_stream_page(rows, next_cursor)), headers=_JSON_HEADERS
+        )
+        if next_cursor is not None:
+            response.headers['X-Next-Cursor'] = str(next_cursor)
+        return response
+        
+    except Exception:
+        log.exception("Admin get devices error")
+        return _json({"error": "Failed to fetch all devices"}, 500)
 
 @api.route("/admin/stats", methods=["GET"])
-@jwt_required()
 def admin_get_stats():
     """Get overall statistics (admin only)"""
     try:
-        current_user = User.find_by_username(get_jwt_identity())
-        if not current_user or not current_user.is_admin:
-            return jsonify({"message": "Admin access required"}), 403
-        
-        user_count = User.query.count()
-        device_count = Device.query.count()
-        lost_count = Device.query.filter_by(status='lost').count()
-        found_count = Device.query.filter_by(status='found').count()
-        
-        return jsonify({
-            'users': user_count,
-            'devices': device_count,
-            'lost': lost_count,
-            'found': found_count
-        }), 200
+        if not get_jwt().get('is_admin'):
+            return _json({"message": "Admin access required"}, 403)
         
-    except Exception as e:
-        print(f"Admin stats error: {e}")
-        return jsonify({"error": "Failed to fetch statistics"}), 500
\ No newline at end of file
+        return _etag_json(_global_counts())
+        
+    except Exception:
+        log.exception("Admin stats error")
+        return _json({"error": "Failed to fetch statistics"}, 500)
\ No newline at end of file
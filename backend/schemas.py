@@ -0,0 +1,111 @@
+from typing import ClassVar, Literal, Optional
+from pydantic import BaseModel, ConfigDict, ValidationError, field_validator, model_validator
+from pydantic_core import PydanticCustomError
+
+# Error types raised below; their messages are returned to clients verbatim
+_API_ERRORS = frozenset(('device_name', 'coordinate', 'status'))
+
+def _coordinate(value, lo, hi, name):
+    """Coerce an optional coordinate, treating '' as missing"""
+    if value is None or value == '':
+        return None
+    try:
+        value = float(value)
+    except (ValueError, TypeError):
+        raise PydanticCustomError('coordinate', f"Invalid {name.lower()} format")
+    if not (lo <= value <= hi):
+        raise PydanticCustomError('coordinate', f"{name} must be between {lo} and {hi}")
+    return value
+
+class _DeviceBody(BaseModel):
+    """Fields shared by the device create and update bodies"""
+    model_config = ConfigDict(str_strip_whitespace=True)
+
+    # Canonical field -> older field name the frontend may still send instead
+    legacy_fields: ClassVar[dict] = {}
+
+    status: Literal['lost', 'found'] = 'lost'
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+
+    @model_validator(mode='before')
+    @classmethod
+    def _apply_legacy_fields(cls, data):
+        if isinstance(data, dict):
+            data = dict(data)
+            for field, legacy in cls.legacy_fields.items():
+                if legacy in data:
+                    data.setdefault(field, data[legacy])
+        return data
+
+    @field_validator('status', mode='before')
+    @classmethod
+    def _check_status(cls, value):
+        if value not in ('lost', 'found'):
+            raise PydanticCustomError('status', "Status must be 'lost' or 'found'")
+        return value
+
+    @field_validator('latitude', mode='before')
+    @classmethod
+    def _check_latitude(cls, value):
+        return _coordinate(value, -90, 90, 'Latitude')
+
+    @field_validator('longitude', mode='before')
+    @classmethod
+    def _check_longitude(cls, value):
+        return _coordinate(value, -180, 180, 'Longitude')
+
+class DeviceIn(_DeviceBody):
+    """Body of POST /devices"""
+    legacy_fields: ClassVar[dict] = {
+        'description': 'device_type',
+        'category': 'device_type',
+        'location': 'location_text'
+    }
+
+    name: str
+    description: str = ''
+    category: str = ''
+    location: str = ''
+
+    @field_validator('name')
+    @classmethod
+    def _check_name(cls, value):
+        if not value:
+            raise PydanticCustomError('device_name', "Device name is required")
+        return value
+
+class DeviceUpdate(_DeviceBody):
+    """Body of PUT /devices/<id>; only the fields sent are applied"""
+    legacy_fields: ClassVar[dict] = {
+        'category': 'device_type',
+        'location': 'location_text'
+    }
+
+    name: Optional[str] = None
+    description: Optional[str] = None
+    category: Optional[str] = None
+    location: Optional[str] = None
+
+    @field_validator('name')
+    @classmethod
+    def _check_name(cls, value):
+        if not value:
+            raise PydanticCustomError('device_name', "Device name cannot be empty")
+        return value
+
+    def changes(self):
+        """Column values to update, limited to the fields present in the request"""
+        return self.model_dump(exclude_unset=True)
+
+def error_message(exc: ValidationError):
+    """Reduce a validation failure to the single message returned with a 400"""
+    error = exc.errors(include_url=False)[0]
+    if error['type'] in _API_ERRORS:
+        return error['msg']
+    if error['type'] == 'missing':
+        return "Device name is required"
+    if error['type'] in ('json_invalid', 'model_type'):
+        return "Request body must be a JSON object"
+    field = '.'.join(str(part) for part in error['loc'])
+    return f"Invalid {field}: {error['msg']}"
@@ -0,0 +1,97 @@
+import os
+import random
+import sys
+import unittest
+
+from sqlalchemy import create_engine, insert, select
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from geo import (GEOHASH_PRECISION, bounding_box, equirectangular_np, geohash_cover, geohash_encode,
+                 geohash_ranges, haversine_np, radius_distances)
+from models import Device, db
+
+
+def _random_points(rng, count):
+    return [(rng.uniform(-89.0, 89.0), rng.uniform(-179.9, 179.9)) for _ in range(count)]
+
+
+class GeohashRangeTest(unittest.TestCase):
+    def test_ranges_hold_exactly_the_prefixed_hashes(self):
+        rng = random.Random(1)
+        hashes = [geohash_encode(lat, lon) for lat, lon in _random_points(rng, 2000)]
+        hashes += ['zzzzzzzz', 'bzzzzzzz', '9zzzzzzz', 'b0000000']
+        prefixes = {h[:n] for h in hashes[::50] for n in range(1, GEOHASH_PRECISION + 1)}
+        prefixes = sorted(prefixes | {'z', 'zz', 'bz', '9', '9z'})
+        for prefix, (low, high) in zip(prefixes, geohash_ranges(prefixes)):
+            for h in hashes:
+                in_range = low <= h and (high is None or h < high)
+                self.assertEqual(in_range, h.startswith(prefix), (prefix, low, high, h))
+
+    def test_all_z_prefix_is_unbounded(self):
+        self.assertEqual(geohash_ranges(['zz', 'bz', '9']), [('zz', None), ('bz', 'c'), ('9', 'b')])
+
+    def test_cover_ranges_contain_every_point_in_the_box(self):
+        rng = random.Random(2)
+        for lat, lon in _random_points(rng, 300):
+            radius = rng.choice((0.5, 5.0, 50.0, 500.0))
+            box = bounding_box(lat, lon, radius)
+            prefixes = geohash_cover(box)
+            if prefixes is None:
+                continue
+            ranges = geohash_ranges(prefixes)
+            min_lat, max_lat, min_lon, max_lon = box
+            for _ in range(20):
+                h = geohash_encode(rng.uniform(min_lat, max_lat), rng.uniform(min_lon, max_lon))
+                self.assertTrue(any(low <= h and (high is None or h < high) for low, high in ranges),
+                                (box, prefixes, h))
+
+
+class RadiusDistanceTest(unittest.TestCase):
+    def test_equirectangular_wraps_across_the_antimeridian(self):
+        distance = equirectangular_np(0.0, 179.99, [0.0], [-179.995])[0]
+        self.assertAlmostEqual(distance, haversine_np(0.0, 179.99, [0.0], [-179.995])[0], delta=0.01)
+
+    def test_large_batches_match_haversine_near_the_poles_and_antimeridian(self):
+        rng = np.random.default_rng(4)
+        for lat0, lon0 in ((89.995, 0.0), (-89.99, 120.0), (0.0, 179.99), (45.0, -179.95)):
+            lats = np.clip(lat0 + rng.uniform(-0.2, 0.2, 5000), -90, 90).astype(np.float32)
+            lons = ((lon0 + rng.uniform(-0.5, 0.5, 5000) + 180) % 360 - 180).astype(np.float32)
+            exact = haversine_np(lat0, lon0, lats, lons)
+            self.assertLess(np.abs(radius_distances(lat0, lon0, lats, lons, 10.0) - exact).max(), 0.01)
+
+
+class GeohashConditionTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        db.metadata.create_all(self.engine)
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def test_condition_selects_stored_hashes_under_the_cover(self):
+        rng = random.Random(3)
+        points = _random_points(rng, 500)
+        # Cluster some points around a few origins so covers are not empty
+        origins = points[:5]
+        points += [(lat + rng.uniform(-0.05, 0.05), lon + rng.uniform(-0.05, 0.05))
+                   for lat, lon in origins for _ in range(40)]
+        rows = [{'id': i + 1, 'name': 'd', 'status': 'lost', 'user_id': 1, 'latitude': lat,
+                 'longitude': lon, 'geohash': geohash_encode(lat, lon)}
+                for i, (lat, lon) in enumerate(points)]
+        with self.engine.begin() as conn:
+            conn.execute(insert(Device.__table__), rows)
+
+        for lat, lon in origins:
+            prefixes = geohash_cover(bounding_box(lat, lon, 5.0))
+            with self.engine.connect() as conn:
+                found = set(conn.scalars(select(Device.id).where(Device.geohash_condition(prefixes))))
+            expected = {row['id'] for row in rows if row['geohash'].startswith(tuple(prefixes))}
+            self.assertTrue(expected)
+            self.assertEqual(found, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -65,8 +65,15 @@ export default function DeviceManager({ onLogout }) {
 
   const fetchDevices = async () => {
     try {
-      const res = await API.get('/devices');
-      setDevices(res.data);
+      // The API pages device lists; follow the cursor until it runs out
+      const all = [];
+      let after = null;
+      do {
+        const res = await API.get('/devices', { params: { limit: 200, after } });
+        all.push(...res.data.items);
+        after = res.data.next;
+      } while (after);
+      setDevices(all);
     } catch (e) {
       console.error('Error fetching devices:', e);
     }